@@ -19,9 +19,40 @@ View the result with `agg.aggregated_df`.
 
 # Python imports
 import os
+import numpy as np
 import pandas as pd
 import ujson as json
-from time import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from timer import Timer
+
+# Number of threads used to write output files
+MAX_WRITE_WORKERS = 8
+
+# Number of file contents held in memory waiting to be written
+MAX_PENDING_WRITES = 2 * MAX_WRITE_WORKERS
+
+def write_file(filepath, text):
+    """Write text to a file and return the file's name."""
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return os.path.basename(filepath)
+
+def wait_for_writes(pending, max_pending=0, verbose=True):
+    """Wait until no more than `max_pending` writes are outstanding.
+
+    @pending (set): Futures returned by submitting `write_file`.
+    @max_pending (int): The number of writes that may still be outstanding.
+    @verbose (bool): Whether to print the name of each file as it is saved.
+
+    Returns the set of outstanding futures.
+    """
+    while len(pending) > max_pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            filename = future.result()
+            if verbose:
+                print('Saved ' + filename)
+    return pending
 
 class TweetAggregator():
     """Perform an aggregation of tweets and save as valid json files.
@@ -39,56 +70,69 @@ class TweetAggregator():
         # Make sure the output folder exists
         self.input_file = input_file
         self.output_dir = output_dir
-        self.records = None
         self.df = None
+        self._dates = None
+        self._tweets = None
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         self.load_records()
 
-    def aggregate_by_daterange(self, date_ranges, aggregate_title):
+    @property
+    def records(self):
+        """Return the loaded records as a list of dicts."""
+        return self.df.to_dict('records')
+
+    def aggregate_by_daterange(self, date_ranges, aggregate_title, indent=0):
         """Aggregate by date range and save json files.
 
         @date_ranges (list): A list of tuples consisting of the start and
                              end dates of a date rang in YYYY-MM-DD format.
         @aggregate_title (str): The value to go in the manifest's title field.
+        @indent (int): Indentation for the json files (e.g. 2). 0 writes compact json.
         """
-        timer = Timer()
-        # For each date range, filter the dataframe and write it to a file
-        for range in date_ranges:
-            manifest = {}
-            manifest['name'] = range[0] + '-' + range[1] + '_twitter_humanities'
-            manifest['namespace'] = 'we1sv2.0'
-            manifest['metapath'] = 'Corpus,twitter'
-            manifest['title'] = aggregate_title
-            manifest['date_range'] = {'start': range[0], 'end': range[1]}
-            filename = range[0] + '-' + range[1] + '.json'
-            aggregated_df = self.df.loc[self.df['date'].between(range[0], range[1], inclusive=True)]
-            tweets = aggregated_df['tidy_tweet'].values.tolist()
-            manifest['content'] = ' '.join(tweets)
-            with open(os.path.join(self.output_dir, filename), 'w') as f:
-                f.write(json.dumps(manifest, indent=2))
-            print('Saved ' + filename)
-        print('Aggregation complete.')
-        print('Time elapsed: %s' % timer.get_time_elapsed())
+        with Timer('Aggregation complete.'):
+            if self._dates is None:
+                self.index_dates()
+            # For each date range, filter the dataframe and write it to a file
+            with ThreadPoolExecutor(max_workers=MAX_WRITE_WORKERS) as executor:
+                pending = set()
+                for range in date_ranges:
+                    manifest = {}
+                    manifest['name'] = range[0] + '-' + range[1] + '_twitter_humanities'
+                    manifest['namespace'] = 'we1sv2.0'
+                    manifest['metapath'] = 'Corpus,twitter'
+                    manifest['title'] = aggregate_title
+                    manifest['date_range'] = {'start': range[0], 'end': range[1]}
+                    filename = range[0] + '-' + range[1] + '.json'
+                    # The dates are sorted, so binary search for the slice bounds
+                    start = self._dates.searchsorted(np.datetime64(range[0]))
+                    end = self._dates.searchsorted(np.datetime64(range[1]), side='right')
+                    manifest['content'] = ' '.join(self._tweets[start:end].tolist())
+                    pending.add(executor.submit(write_file, os.path.join(self.output_dir, filename),
+                                                json.dumps(manifest, indent=indent)))
+                    pending = wait_for_writes(pending, MAX_PENDING_WRITES)
+                wait_for_writes(pending)
 
     def aggregate_by_filter(self, filter):
         """Aggregate by filter and save json files.
 
         @filter (str): The column value to filter by.
         """
-        timer = Timer()
-        count = 0
-        values = self.df[filter].values.tolist()
-        values = sorted(list(set(values)))
-        for value in values:
-            filename = value + '.json'
-            aggregated_df = self.df[self.df[filter] == value]
-            if len(aggregated_df[filter]) > 1:
-                count += 1
-            aggregated_df.to_json(os.path.join(self.output_dir, filename), orient='records', lines=True)
-            print('Saved ' + filename)
-        print('Aggregation complete.')
-        print('Time elapsed: %s' % timer.get_time_elapsed())
+        with Timer('Aggregation complete.'):
+            # Serialize all records once, ordered so that each group is a
+            # contiguous run of lines, then write each run to its own file
+            ordered = self.df.sort_values(filter, kind='mergesort')
+            lines = ordered.to_json(orient='records', lines=True).rstrip('\n').split('\n')
+            with ThreadPoolExecutor(max_workers=MAX_WRITE_WORKERS) as executor:
+                pending = set()
+                start = 0
+                for value, size in ordered.groupby(filter, sort=True, observed=True).size().items():
+                    filename = value + '.json'
+                    pending.add(executor.submit(write_file, os.path.join(self.output_dir, filename),
+                                                '\n'.join(lines[start:start + size]) + '\n'))
+                    pending = wait_for_writes(pending, MAX_PENDING_WRITES)
+                    start += size
+                wait_for_writes(pending)
 
     def aggregate_multiple_tweeters(self, output_file, minimum_num_tweets=2, save=True):
         """Save a copy of the input file with only users with multiple tweets.
@@ -98,7 +142,9 @@ class TweetAggregator():
         @save (bool): Whether or not to save the output file.
         """
         timer = Timer()
-        multiple_tweeters = self.df.groupby('username').filter(lambda x: x['username'].count() >= minimum_num_tweets)
+        counts = self.df['username'].value_counts()
+        tweeters = counts.index[counts >= minimum_num_tweets]
+        multiple_tweeters = self.df[self.df['username'].isin(tweeters)]
         if save == True:
             multiple_tweeters.to_json(output_file, orient='records', lines=True)
         else:
@@ -106,7 +152,7 @@ class TweetAggregator():
         print('Aggregation complete.')
         print('Time elapsed: %s' % timer.get_time_elapsed())
 
-    def aggregate_tweeters(self, df, output_file, file_suffix=None, group_by_col='username', join_col='tidy_tweet', save=False):
+    def aggregate_tweeters(self, df, output_file, file_suffix=None, group_by_col='username', join_col='tidy_tweet', save=False, indent=0):
         """Save all tweets by each author into separate json files.
 
         @df (dataframe): The input dataframe.
@@ -115,46 +161,47 @@ class TweetAggregator():
         @group_by_col (str): The column on which the new dataframe will be grouped
         @join_col (str): The column for which the text in each item group will be joined
         @save (bool): Pass False to aggregate_multiple_tweeters() so that its output is not saved to file.
+        @indent (int): Indentation for the json files (e.g. 2). 0 writes compact json.
 
         Returns a dataframe with the group by column and the joined column.
         """
-        timer = Timer()
-        multiple_tweeters = self.aggregate_multiple_tweeters(output_file, minimum_num_tweets=1, save=False)
-        grouped = multiple_tweeters.groupby(group_by_col)[join_col]
-        aggregated_records = grouped.apply(lambda x: '%s' % ' '.join(x))
-        for _, row in aggregated_records.iterrows():
-            manifest = {'name': row['username'] + file_suffix, 'namespace': 'we1sv2.0', 'metapath': 'Projects'}
-            manifest['content'] = row['tidy_tweet']
-            fn = manifest['name'] + '.json'
-            filepath = os.path.join(self.output_dir, fn)
-            with open(filepath, 'w') as f:
-                f.write(json.dumps(manifest, indent=2))
-        print('Aggregation complete.')
-        print('Time elapsed: %s' % timer.get_time_elapsed())
+        with Timer('Aggregation complete.'):
+            multiple_tweeters = self.aggregate_multiple_tweeters(output_file, minimum_num_tweets=1, save=False)
+            if file_suffix is None:
+                file_suffix = ''
+            aggregated_records = multiple_tweeters.groupby(group_by_col, observed=True)[join_col].agg(' '.join)
+            with ThreadPoolExecutor(max_workers=MAX_WRITE_WORKERS) as executor:
+                pending = set()
+                for value, content in aggregated_records.items():
+                    manifest = {'name': value + file_suffix, 'namespace': 'we1sv2.0', 'metapath': 'Projects'}
+                    manifest['content'] = content
+                    fn = manifest['name'] + '.json'
+                    filepath = os.path.join(self.output_dir, fn)
+                    pending.add(executor.submit(write_file, filepath,
+                                                json.dumps(manifest, indent=indent)))
+                    pending = wait_for_writes(pending, MAX_PENDING_WRITES, verbose=False)
+                wait_for_writes(pending, verbose=False)
+        return aggregated_records.reset_index()
+
+    def index_dates(self):
+        """Cache the dates and tidy tweets in date order.
+
+        The dataframe keeps its input order; the sorted copies let date
+        ranges be looked up by index.
+        """
+        dates = pd.to_datetime(self.df['date']).values
+        order = np.argsort(dates, kind='stable')
+        self._dates = dates[order]
+        self._tweets = self.df['tidy_tweet'].to_numpy(dtype=object)[order]
 
     def load_records(self):
         """Load the records from the input file."""
-        timer = Timer()
-        self.records = map(json.loads, open(self.input_file, encoding='utf-8'))
-        self.df = pd.DataFrame.from_records(self.records)
-        print('Records loaded.')
-        print('Time elapsed: %s' % timer.get_time_elapsed())
-
-class Timer:
-    """Create a timer object."""
-
-    def __init__(self):
-        """Initialise the timer object."""
-        self.start = time()
-
-    def restart(self):
-        """Restart the timer."""
-        self.start = time()
-
-    def get_time_elapsed(self):
-        """Get the elapsed time and format it as hours, minutes, and seconds."""
-        end = time()
-        m, s = divmod(end - self.start, 60)
-        h, m = divmod(m, 60)
-        time_str = "%02d:%02d:%02d" % (h, m, s)
-        return time_str
+        self._dates = None
+        self._tweets = None
+        with Timer('Records loaded.'):
+            # Parse the ndjson directly into columns; keep dates as strings
+            self.df = pd.read_json(self.input_file, lines=True, dtype=False,
+                                   convert_dates=False, encoding='utf-8')
+            # Usernames repeat across tweets, so store them as integer codes
+            if 'username' in self.df:
+                self.df['username'] = self.df['username'].astype('category')
@@ -9,19 +9,25 @@ pp.preprocess(input_file, output_file)
 
 # Python imports
 import re
+import numpy as np
+import pandas as pd
 import spacy
 import unicodedata
-import ujson as json
-from bs4 import BeautifulSoup
-from dateutil.parser import parse
 from ftfy import fix_text
+from html import unescape
+from spacy.attrs import ENT_TYPE, IS_PUNCT, IS_QUOTE, IS_SPACE, IS_STOP, LENGTH, LIKE_NUM, LIKE_URL, NORM
+from spacy.lang.char_classes import LIST_ICONS
 from spacy.language import Language
 from spacy.lang.en.stop_words import STOP_WORDS
 from spacy.symbols import ORTH, LEMMA, POS, TAG
 from spacy.tokenizer import Tokenizer
 from spacy.tokens import Token
 from spacymoji import Emoji
-from time import time
+from timer import Timer
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # Happy Emoticons
 emoticons_happy = set([
@@ -41,7 +47,10 @@ emoticons_sad = set([
 # All Emoticons
 EMOTICONS = emoticons_happy.union(emoticons_sad)
 
-#Emoji patterns
+# Norm assigned to emoticons by the tokenizer's special cases
+EMOTICON_NORM = '__EMOTICON__'
+
+# Emoji patterns (not used by the pipeline, which detects emoji with spacymoji)
 emoji_pattern = re.compile('['
          u'\U0001F600-\U0001F64F'  # emoticons
          u'\U0001F300-\U0001F5FF'  # symbols & pictographs
@@ -51,27 +60,113 @@ emoji_pattern = re.compile('['
          u'\U000024C2-\U0001F251'
          ']+', flags=re.UNICODE)
 
+# Unaccented forms of the Latin-1 Supplement and Latin Extended-A letters
+ACCENT_TABLE = {
+    ord(c): ''.join(d for d in unicodedata.normalize('NFKD', c) if not unicodedata.combining(d))
+    for c in map(chr, range(0xC0, 0x180))
+}
+
+# HTML tags and comments (a '<' not followed by a tag name, as in '<3', is text)
+HTML_TAG_PATTERN = re.compile(r'<!--.*?-->|</?[A-Za-z][^<>]*>', flags=re.DOTALL)
+
+# Infixes split inside tweet tokens: icons (including emoji), ellipses,
+# punctuation between letters and sentence breaks missing a space. Unlike
+# spaCy's defaults, hyphenated words, slash-joined words and numeric
+# expressions are left whole.
+TWEET_INFIXES = LIST_ICONS + [
+    r'\.\.+',
+    r'\u2026',
+    r'(?<=[^\W\d_])[,;:!?()](?=[^\W\d_])',
+    r'(?<=[a-z])\.(?=[A-Z])'
+]
+
+# Tweet link parts replaced when building record names
+LINK_PATTERN = re.compile(r'https://twitter\.com/|/')
+LINK_REPLACEMENTS = {'https://twitter.com/': '__', '/': '_'}
+
+# Date-like tokens (numeric dates, years, times, ordinals, months and weekdays)
+DATE_TOKEN_PATTERN = re.compile(r'''^(?:
+    \d{1,4}(?:[-/.]\d{1,2}(?:[-/.]\d{1,4})?)?
+    |\d{1,2}(?:st|nd|rd|th)
+    |\d{1,2}(?::\d{2}){1,2}(?:am|pm)?
+    |\d{1,2}(?:am|pm)
+    |jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?
+    |aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?
+    |mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?
+    |fri(?:day)?|sat(?:urday)?|sun(?:day)?
+    )$''', flags=re.IGNORECASE | re.VERBOSE)
+
+# Token attributes exported by `Doc.to_array()` for filtering. The boolean
+# flags come first; any token with one of them set is dropped.
+FILTER_ATTRS = [IS_STOP, IS_PUNCT, IS_QUOTE, IS_SPACE, LIKE_NUM, LIKE_URL, ENT_TYPE, NORM, LENGTH]
+NUM_FILTER_FLAGS = 6
+ENT_TYPE_COLUMN = 6
+NORM_COLUMN = 7
+LENGTH_COLUMN = 8
+
+# Entity types whose tokens are dropped
+SKIP_ENT_TYPES = ['MONEY', 'DATE', 'TIME', 'QUANTITY']
+
 # Handle lemmatization exceptions
 LEMMATIZATION_CASES = {
     'humanities': [{ORTH: u'humanities', LEMMA: u'humanities', POS: u'NOUN', TAG: u'NNS'}]
 }
 
+# Functions
+
+def filter_mask(attrs, skip_ent_ids, emoticon_id):
+    """Return a boolean mask of the tokens to keep.
+
+    @attrs (array): The output of `doc.to_array(FILTER_ATTRS)`.
+    @skip_ent_ids (array): The hashes of the entity types to drop.
+    @emoticon_id (int): The hash of EMOTICON_NORM.
+    """
+    return (~attrs[:, :NUM_FILTER_FLAGS].any(axis=1)
+            & ~np.isin(attrs[:, ENT_TYPE_COLUMN], skip_ent_ids)
+            & (attrs[:, NORM_COLUMN] != emoticon_id)
+            & (attrs[:, LENGTH_COLUMN] > 1))
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _compiled_filter_mask(attrs, skip_ent_ids, emoticon_id):
+        """Return a boolean mask of the tokens to keep (compiled with numba)."""
+        keep = np.ones(attrs.shape[0], dtype=np.bool_)
+        for i in range(attrs.shape[0]):
+            for j in range(NUM_FILTER_FLAGS):
+                if attrs[i, j]:
+                    keep[i] = False
+            if attrs[i, NORM_COLUMN] == emoticon_id or attrs[i, LENGTH_COLUMN] < 2:
+                keep[i] = False
+            for ent_id in skip_ent_ids:
+                if attrs[i, ENT_TYPE_COLUMN] == ent_id:
+                    keep[i] = False
+        return keep
+
+    # Use the compiled mask when numba is installed
+    filter_mask = _compiled_filter_mask
+
 # Classes
 
 class TwitterPreprocessor():
     """Class for preprocessing tweets."""
 
-    def __init__(self, stoplist_file=None, language_model='en_core_web_sm'):
-        """Initialize the TwitterPreprocessor object."""
-        timer = Timer()
-        self.nlp = spacy.load(language_model)
-        self.build_pipeline()
-        self.nlp.tokenizer = self.create_tokenizer()
-        self.customize_lemmas()
-        if stoplist_file is not None:
-            self.load_custom_stoplist(stoplist_file)
-        print('Preprocessor setup complete.')
-        print('Time elapsed: %s' % timer.get_time_elapsed())
+    def __init__(self, stoplist_file=None, language_model='en_core_web_sm',
+                 disable=['tagger', 'parser']):
+        """Initialize the TwitterPreprocessor object.
+
+        @disable (list): Pipeline components not needed for filtering tweets.
+        """
+        with Timer('Preprocessor setup complete.'):
+            self.nlp = spacy.load(language_model, disable=disable)
+            self.skip_ent_ids = np.array([self.nlp.vocab.strings.add(label) for label in SKIP_ENT_TYPES],
+                                         dtype=np.uint64)
+            self.emoticon_id = np.uint64(self.nlp.vocab.strings.add(EMOTICON_NORM))
+            self.build_pipeline()
+            self.nlp.tokenizer = self.create_tokenizer()
+            self.customize_lemmas()
+            self.customize_emoticons()
+            if stoplist_file is not None:
+                self.load_custom_stoplist(stoplist_file)
 
     def build_pipeline(self):
         """Build spaCy pipeline."""
@@ -87,9 +182,10 @@ class TwitterPreprocessor():
         from spacy.lang.tokenizer_exceptions import URL_PATTERN
 
         # spacy defaults: when the standard behaviour is required, they
-        # need to be included when subclassing the tokenizer
+        # need to be included when subclassing the tokenizer. Tweets use a
+        # slimmer set of infixes.
         prefix_re = spacy.util.compile_prefix_regex(Language.Defaults.prefixes)
-        infix_re = spacy.util.compile_infix_regex(Language.Defaults.infixes)
+        infix_re = spacy.util.compile_infix_regex(TWEET_INFIXES)
         suffix_re = spacy.util.compile_suffix_regex(Language.Defaults.suffixes)
 
         # extending the default url regex with regex for hashtags with "or" = |
@@ -111,6 +207,11 @@ class TwitterPreprocessor():
         for k, v in LEMMATIZATION_CASES.items():
             self.nlp.tokenizer.add_special_case(k, v)
 
+    def customize_emoticons(self):
+        """Add special cases that keep emoticons whole and mark their norm."""
+        for emoticon in EMOTICONS:
+            self.nlp.tokenizer.add_special_case(emoticon, [{ORTH: emoticon, NORM: EMOTICON_NORM}])
+
     def load_custom_stoplist(self, stoplist_file):
         """Load custom stoplist."""
         with open(stoplist_file, 'r') as f:
@@ -119,56 +220,57 @@ class TwitterPreprocessor():
             STOP_WORDS.add(item)
             self.nlp.vocab[item].is_stop = True
 
-    def preprocess(self, input_file, output_file):
+    def preprocess(self, input_file, output_file, batch_size=1000, n_process=1):
         """Preprocess tweets from a file of line-delimited json objects.
 
         Saves the objects to a new file with a field called 'tidy_tweet'
         containing the preprocessed tweet.
+
+        @batch_size (int): The number of tweets to send through spaCy at a time.
+        @n_process (int): The number of processes spaCy should use.
         """
-        timer = Timer()
-        records = list(map(json.loads, open(input_file, encoding='utf-8')))
-        with open(output_file, 'w') as f:
-            for row in records:
-                row['tidy_tweet'] = self.preprocess_tweet(row['tweet'])
-                row['name'] = row['date'] + row['link'].replace('https://twitter.com/', '__').replace('/', '_')
-                f.write(json.dumps(row) + '\n')
-        print('Preprocessing complete.')
-        print('Time elapsed: %s' % timer.get_time_elapsed())
+        with Timer('Preprocessing complete.'):
+            df = pd.read_json(input_file, lines=True, dtype=False,
+                              convert_dates=False, encoding='utf-8')
+            tweets = [self.clean_tweet(tweet) for tweet in df['tweet']]
+            docs = self.nlp.pipe(tweets, batch_size=batch_size, n_process=n_process)
+            df['tidy_tweet'] = [self.filter_tokens(doc) for doc in docs]
+            links = df['link'].str.replace(LINK_PATTERN, lambda m: LINK_REPLACEMENTS[m.group(0)], regex=True)
+            df['name'] = df['date'] + links
+            df.to_json(output_file, orient='records', lines=True)
 
     def preprocess_tweet(self, tweet):
         """Preprocess a single tweet."""
+        return self.filter_tokens(self.nlp(self.clean_tweet(tweet)))
+
+    def clean_tweet(self, tweet):
+        """Normalise the text of a tweet before it is passed to spaCy."""
         tweet = fix_text(tweet, normalization='NFC')
         tweet = self.remove_accents(tweet, method='unicode')
-        tweet = self.strip_html_tags(tweet).strip()
-        doc = self.nlp(tweet)
-        tokens = [token.norm_.strip().replace(' ', '_') for token in doc
+        return self.strip_html_tags(tweet).strip()
+
+    def filter_tokens(self, doc):
+        """Filter the tokens of a processed tweet and join the remainder."""
+        keep = filter_mask(doc.to_array(FILTER_ATTRS), self.skip_ent_ids, self.emoticon_id)
+        tokens = [doc[i] for i in keep.nonzero()[0].tolist()]
+        tokens = [token.norm_.strip().replace(' ', '_') for token in tokens
                 if not token._.is_emoji
-                and token.text not in EMOTICONS
-                and not token.is_stop
-                and not token.is_punct
-                and not token.is_quote
-                and not token.is_space
-                and not token.like_num
-                and not token.like_url
                 and not token.text.startswith('pic.twitter.com')
-                and not token.ent_type_ == 'MONEY'
-                and not token.ent_type_ == 'DATE'
-                and not token.ent_type_ == 'TIME'
-                and not token.ent_type_ == 'QUANTITY'
                 and token.text != "'s"
-                and len(token.text) > 1
                 ]
-        new_tokens = []
-        for token in tokens:
-            try:
-                parse(token, fuzzy_with_tokens=True)
-            except:
-                new_tokens.append(token)
-        return ' '.join(new_tokens)
+        tokens = [token for token in tokens if not DATE_TOKEN_PATTERN.match(token)]
+        return ' '.join(tokens)
 
     def remove_accents(self, text, method='unicode'):
         """Replace accents with unaccented letters"""
         if method == 'unicode':
+            if text.isascii():
+                return text
+            # Most accented letters are covered by the table; fall back to
+            # full decomposition for anything else
+            text = text.translate(ACCENT_TABLE)
+            if text.isascii():
+                return text
             return ''.join(
                 c
                 for c in unicodedata.normalize('NFKD', text)
@@ -205,23 +307,8 @@ class TwitterPreprocessor():
         if html is None:
             return None
         else:
-            return ''.join(BeautifulSoup(html).findAll(text=True))
-
-class Timer:
-    """Create a timer object."""
-
-    def __init__(self):
-        """Initialise the timer object."""
-        self.start = time()
-
-    def restart(self):
-        """Restart the timer."""
-        self.start = time()
-
-    def get_time_elapsed(self):
-        """Get the elapsed time and format it as hours, minutes, and seconds."""
-        end = time()
-        m, s = divmod(end - self.start, 60)
-        h, m = divmod(m, 60)
-        time_str = "%02d:%02d:%02d" % (h, m, s)
-        return time_str
+            if '<' in html:
+                html = HTML_TAG_PATTERN.sub('', html)
+            if '&' in html:
+                html = unescape(html)
+            return html
@@ -0,0 +1,53 @@
+"""timer.py.
+
+Usage:
+
+timer = Timer()
+...
+print('Time elapsed: %s' % timer.get_time_elapsed())
+
+Or, to print a message and the elapsed time when a block finishes:
+
+with Timer('Aggregation complete.'):
+    ...
+"""
+
+# Python imports
+from time import perf_counter_ns
+
+class Timer:
+    """Create a timer object.
+
+    @label (str): A message printed before the elapsed time when the timer
+                  is used as a context manager.
+    """
+
+    def __init__(self, label=None):
+        """Initialise the timer object."""
+        self.label = label
+        self.start = perf_counter_ns()
+
+    def __enter__(self):
+        """Restart the timer at the start of a block."""
+        self.restart()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Print the label and the elapsed time if the block succeeded."""
+        if exc_type is None:
+            if self.label is not None:
+                print(self.label)
+            print('Time elapsed: %s' % self.get_time_elapsed())
+
+    def restart(self):
+        """Restart the timer."""
+        self.start = perf_counter_ns()
+
+    def get_time_elapsed(self):
+        """Get the elapsed time and format it as hours, minutes, and seconds."""
+        seconds = (perf_counter_ns() - self.start) // 1000000000
+        if seconds < 60:
+            return '00:00:%02d' % seconds
+        m, s = divmod(seconds, 60)
+        h, m = divmod(m, 60)
+        return '%02d:%02d:%02d' % (h, m, s)